@@ -1,54 +1,32 @@
-import os
 import json
-import sys
 import re
-from dotenv import load_dotenv
-from google import genai
+import asyncio
+import orjson
 from google.genai import types
+from cache import FileCache, make_key
+from gemini_client import GROUNDING_TOOL, strip_fences, stream_until_json
 
-# 1. Load Keys
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
+# Compiled once: fallback for a bare [ ... ] array outside a ```json block
+_JSON_ARRAY_RE = re.compile(r"(\[[\s\S]*\])")
 
-if not api_key:
-    print("❌ Error: GEMINI_API_KEY not found in .env file!")
-    sys.exit()
+# Narratives move fast, so scout results only live for 15 minutes
+SCOUT_TTL = 900
+scout_cache = FileCache("scout")
 
-# 2. Configure Client
-try:
-    client = genai.Client(api_key=api_key)
-    print("✅ Client initialized.")
-except Exception as e:
-    print(f"❌ Error initializing client: {e}")
-    sys.exit()
-
-def extract_json(text):
-    """Helper to find JSON block inside narrative text"""
-    try:
-        # Look for markdown code block
-        match = re.search(r"```json\s*([\s\S]*?)\s*```", text)
-        if match:
-            return json.loads(match.group(1))
-        
-        # Fallback: Look for just { ... } or [ ... ]
-        match = re.search(r"(\[[\s\S]*\])", text)
-        if match:
-            return json.loads(match.group(1))
-            
-        return None
-    except Exception:
-        return None
-
-def scan_market():
-    print("🧠 Gemini 2.5 Lite is hunting for Moonshots (Safety Filters: OFF)...")
-    
-    # 3. Search Tool
-    grounding_tool = types.Tool(
-        google_search=types.GoogleSearch()
+# Built once at import: the scan prompt and config never change between calls
+SAFETY_OFF = [
+    types.SafetySetting(category=category, threshold="BLOCK_NONE")
+    for category in (
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "HARM_CATEGORY_HARASSMENT",
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
     )
+]
+SCAN_CONFIG = types.GenerateContentConfig(tools=[GROUNDING_TOOL], safety_settings=SAFETY_OFF)
 
-    # 4. PROMPT (Now includes 'type' requirement)
-    prompt = """
+# Now includes 'type' requirement
+SCAN_PROMPT = """
     Act as an Aggressive Venture Capitalist hunting for 'Asymmetrical Upside' (10x-100x potential).
     
     TASK 1: STOCKS
@@ -74,41 +52,42 @@ def scan_market():
     ]
     ```
     """
+SCAN_CACHE_KEY = make_key(SCAN_PROMPT)
+
+def extract_json(text):
+    """Helper to find JSON block inside narrative text"""
+    try:
+        # Look for markdown code block
+        if '```json' in text:
+            return orjson.loads(strip_fences(text))
+        
+        # Fallback: Look for just { ... } or [ ... ]
+        match = _JSON_ARRAY_RE.search(text)
+        if match:
+            return orjson.loads(match.group(1))
+            
+        return None
+    except Exception:
+        return None
+
+async def scan_market():
+    print("🧠 Gemini 2.5 Lite is hunting for Moonshots (Safety Filters: OFF)...")
+    
+    cached = scout_cache.get(SCAN_CACHE_KEY, ttl=SCOUT_TTL)
+    if cached:
+        print("♻️ Using cached scout results.")
+        return cached
     
     try:
-        # 5. Generate with Safety Settings OFF
-        response = client.models.generate_content(
-            model="models/gemini-2.5-flash-lite",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                tools=[grounding_tool],
-                safety_settings=[
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                        threshold="BLOCK_NONE"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HARASSMENT",
-                        threshold="BLOCK_NONE"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HATE_SPEECH",
-                        threshold="BLOCK_NONE"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        threshold="BLOCK_NONE"
-                    ),
-                ]
-            )
-        )
+        # 1. Generate with Safety Settings OFF (streamed, stops once the JSON block is complete)
+        text, last_chunk = await stream_until_json(contents=SCAN_PROMPT, config=SCAN_CONFIG)
         
-        # 6. DEBUGGING BLACK BOX
-        if not response.text:
+        # 2. DEBUGGING BLACK BOX
+        if not text:
             print("\n⚠️ DEBUG: Response text is empty.")
             
-            if response.candidates:
-                candidate = response.candidates[0]
+            if last_chunk and last_chunk.candidates:
+                candidate = last_chunk.candidates[0]
                 print(f"🛑 Finish Reason: {candidate.finish_reason}")
                 
                 # Check safety ratings to see if one triggered
@@ -120,12 +99,13 @@ def scan_market():
             return "❌ AI returned empty text."
 
         # Extract the JSON using our helper
-        data = extract_json(response.text)
+        data = extract_json(text)
         
         if not data:
-            print(f"⚠️ Could not find JSON in response:\n{response.text[:200]}...")
+            print(f"⚠️ Could not find JSON in response:\n{text[:200]}...")
             return []
             
+        scout_cache.set(SCAN_CACHE_KEY, data)
         return data
         
     except Exception as e:
@@ -133,7 +113,7 @@ def scan_market():
 
 # Test Run
 if __name__ == "__main__":
-    result = scan_market()
+    result = asyncio.run(scan_market())
     print("\n--- MOONSHOT SCOUT REPORT ---")
     if isinstance(result, list):
         print(json.dumps(result, indent=2))
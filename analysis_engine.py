@@ -1,109 +1,237 @@
-import os
 import json
 import time
-import yfinance as yf
-import pandas as pd
-import pandas_ta as ta
-import ccxt
-from dotenv import load_dotenv
-from google import genai
+import asyncio
+from functools import lru_cache
+from typing import TypedDict
+import numpy as np
+import orjson
+from curl_cffi import requests as cffi_requests
 from google.genai import types
+from cache import FileCache, make_key
+from gemini_client import GROUNDING_TOOL, strip_fences, stream_until_json
 
-# 1. Load Keys & Configure Gemini
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
+# One persistent browser-like session for every Yahoo call: reuses the TLS connection
+# and avoids Yahoo's rate limiting of bare `requests` clients
+YF_SESSION = cffi_requests.Session(impersonate="chrome")
 
-if not api_key:
-    print("❌ Error: GEMINI_API_KEY not found in .env file!")
-    exit()
+# Social sentiment rarely flips within half an hour
+SENTIMENT_TTL = 1800
+# Share of the Moonshot score that comes from Gemini sentiment
+STOCK_SENTIMENT_WEIGHT = 0.5
+CRYPTO_SENTIMENT_WEIGHT = 0.6
+# Market cap barely moves intraday, one lookup per day is plenty
+FUNDAMENTALS_TTL = 86400
 
-try:
-    client = genai.Client(api_key=api_key)
-except Exception as e:
-    print(f"❌ Error initializing client: {e}")
-    exit()
+# Built once at import: only {ticker} / {asset_type} change between calls
+SENTIMENT_CONFIG = types.GenerateContentConfig(
+    tools=[GROUNDING_TOOL],
+    safety_settings=[
+        types.SafetySetting(
+            category="HARM_CATEGORY_DANGEROUS_CONTENT",
+            threshold="BLOCK_NONE"
+        ),
+    ]
+)
+
+SENTIMENT_PROMPT = """
+    Act as a Social Sentiment Analyst.
+    
+    Step 1: Search for real-time discussions about {ticker} ({asset_type}) on X (Twitter) and Reddit.
+    Step 2: Analyze the "Vibe":
+       - Are people HYPE/BULLISH? (High Score 80-100)
+       - Are people ANGRY/BEARISH? (Low Score 0-20)
+       - Is it dead silence? (Mid Score 40-60)
+    
+    Step 3: Output a JSON block with a score (0-100) and a very short reason.
+    
+    CRITICAL: Return ONLY valid JSON.
+    
+    Example:
+    ```json
+    {{ "score": 85, "reason": "Trending on X with new partnership rumors" }}
+    ```
+    """
+
+class Sentiment(TypedDict):
+    score: int
+    reason: str
+
+def _read_sentiment(data):
+    """Checks the shape of Gemini's parsed JSON. Returns a Sentiment, or None if it's malformed."""
+    if not isinstance(data, dict) or not isinstance(data.get('score'), (int, float)):
+        return None
+    return Sentiment(score=data['score'], reason=str(data.get('reason', "No reason given")))
+
+fundamentals_cache = FileCache("fundamentals")
+
+@lru_cache(maxsize=256)
+def _market_cap(ticker, day):
+    """
+    `day` is only part of the memo key, so the in-process cache also expires daily.
+    Raises when Yahoo has no cap - lru_cache doesn't keep exceptions, so a bad lookup is retried next time.
+    """
+    key = make_key(ticker)
+    cached = fundamentals_cache.get(key, ttl=FUNDAMENTALS_TTL)
+    if cached:
+        return cached['market_cap']
+
+    import yfinance as yf  # lazy: only loaded once a scan actually runs
+    # fast_info hits the lightweight quote endpoint instead of scraping the full .info page.
+    # NOTE: index it - FastInfo.get() only knows the camelCase keys, so .get('market_cap') is always the default
+    mkt_cap = yf.Ticker(ticker, session=YF_SESSION).fast_info['market_cap']
+    if not mkt_cap:
+        raise ValueError(f"Yahoo has no market cap for {ticker}")
+    fundamentals_cache.set(key, {"market_cap": mkt_cap})
+    return mkt_cap
+
+def is_moonshot_cap(mkt_cap):
+    # Moonshot Zone: $300M - $20B
+    return 300_000_000 < mkt_cap < 20_000_000_000
+
+def get_market_cap(ticker):
+    """Market cap in USD. Memoized in-process and on disk for 24h; raises if the lookup fails (never memoized)."""
+    return _market_cap(ticker, int(time.time() // FUNDAMENTALS_TTL))
 
 class MoonshotAnalyzer:
     def __init__(self):
         print("⚙️ Initializing Analysis Engine...")
+        self._exchange = None
+        self.sentiment_cache = FileCache("sentiment")
+
+    @property
+    def exchange(self):
         # We use Binance for Crypto data (Largest volume)
-        self.exchange = ccxt.binance()
+        # Async client so every candidate's candles can be fetched at once.
+        # ccxt is huge, so it is only imported the first time we actually need Binance.
+        if self._exchange is None:
+            import ccxt.async_support as ccxt_async
+            self._exchange = ccxt_async.binance({'enableRateLimit': True})
+        return self._exchange
         
-    def get_gemini_sentiment(self, ticker, asset_type):
+    async def fetch_crypto_ohlcv(self, tickers, limit=50):
+        """Fetches daily candles for all tickers concurrently. Returns {ticker: ohlcv or None}"""
+        if not tickers: return {} # Stock-only scan: don't import ccxt / load Binance markets at all
+        # Markets load once per process (ccxt caches them), so unlisted pairs skip a guaranteed 404
+        try:
+            markets = await self.exchange.load_markets()
+        except Exception as e:
+            print(f"⚠️ Could not load Binance markets: {e}")
+            markets = None
+
+        async def fetch(ticker):
+            symbol = f"{ticker.upper()}/USDT"
+            if markets is not None and symbol not in markets:
+                print(f"⏭️ {symbol} is not listed on Binance.")
+                return None
+            try:
+                return await self.exchange.fetch_ohlcv(symbol, timeframe='1d', limit=limit)
+            except Exception as e:
+                print(f"⚠️ Could not fetch data for {symbol} on Binance: {e}")
+                return None
+
+        results = await asyncio.gather(*[fetch(t) for t in tickers])
+        return dict(zip(tickers, results))
+
+    async def close(self):
+        """Closes the exchange's HTTP session (call on shutdown)"""
+        if self._exchange is not None:
+            await self._exchange.close()
+
+    async def get_gemini_sentiment(self, ticker, asset_type):
         """
         Uses Gemini to search X (Twitter) & Reddit for 'Vibe Checks'.
         Returns: Score (0-100) and a short summary.
         """
+        key = make_key(ticker, asset_type)
+        cached = self.sentiment_cache.get(key, ttl=SENTIMENT_TTL)
+        if cached:
+            print(f"♻️ Using cached sentiment for {ticker}")
+            return cached['score'], cached['reason']
+
         print(f"🤖 Gemini is checking social sentiment for {ticker}...")
         
         # We target social media specifically in the search query
         search_query = f"${ticker} {asset_type} sentiment discussion site:x.com OR site:reddit.com"
         
-        grounding_tool = types.Tool(
-            google_search=types.GoogleSearch()
-        )
-
-        prompt = f"""
-        Act as a Social Sentiment Analyst.
-        
-        Step 1: Search for real-time discussions about {ticker} ({asset_type}) on X (Twitter) and Reddit.
-        Step 2: Analyze the "Vibe":
-           - Are people HYPE/BULLISH? (High Score 80-100)
-           - Are people ANGRY/BEARISH? (Low Score 0-20)
-           - Is it dead silence? (Mid Score 40-60)
-        
-        Step 3: Output a JSON block with a score (0-100) and a very short reason.
-        
-        CRITICAL: Return ONLY valid JSON.
-        
-        Example:
-        ```json
-        {{ "score": 85, "reason": "Trending on X with new partnership rumors" }}
-        ```
-        """
+        prompt = SENTIMENT_PROMPT.format(ticker=ticker, asset_type=asset_type)
         
         try:
             # We use the search tool to let Gemini read the live internet
-            response = client.models.generate_content(
-                model="models/gemini-2.5-flash-lite",
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    tools=[grounding_tool],
-                    safety_settings=[
-                        types.SafetySetting(
-                            category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                            threshold="BLOCK_NONE"
-                        ),
-                    ]
-                )
-            )
+            # Streamed: we stop reading as soon as the JSON block is complete
+            text, _ = await stream_until_json(contents=prompt, config=SENTIMENT_CONFIG)
 
             # Clean JSON
-            if not response.text: return 50, "No Sentiment Data"
-            clean_text = response.text.replace('```json', '').replace('```', '').strip()
-            data = json.loads(clean_text)
-            return data['score'], data['reason']
+            if not text: return 50, "No Sentiment Data"
+            try:
+                data = orjson.loads(strip_fences(text))
+            except orjson.JSONDecodeError:
+                return 50, "Parse Error"
+            sentiment = _read_sentiment(data)
+            if not sentiment: return 50, "Parse Error"
+            self.sentiment_cache.set(key, sentiment)
+            return sentiment['score'], sentiment['reason']
 
         except Exception as e:
             print(f"⚠️ Sentiment Check Failed: {e}")
             return 50, "Neutral (AI Error)"
 
-    def analyze_stock(self, ticker):
+    async def analyze_stock(self, ticker, df=None):
         """
         3-Layer Analysis for Stocks
+        Pass `df` (6mo daily candles) to skip the download, e.g. from a bulk fetch.
+        """
+        scored = await self.score_stock(ticker, df)
+        return await self.apply_sentiment(*scored) if scored else None
+
+    async def analyze_crypto(self, ticker, ohlcv):
+        """
+        3-Layer Analysis for Crypto
+        `ohlcv` comes from fetch_crypto_ohlcv. Only the last 50 daily candles are scored,
+        so the longer chart window can be passed in as-is.
+        """
+        scored = self.score_crypto(ticker, ohlcv)
+        return await self.apply_sentiment(*scored) if scored else None
+
+    async def score_stock(self, ticker, df=None, mkt_cap=None):
+        """
+        Layers 1 + 2 for Stocks (no Gemini call).
+        Pass `mkt_cap` (the cap, or the Exception from a failed lookup) if it was already looked up.
+        Returns (base_score, report), or None if the stock is filtered out.
         """
         print(f"🔍 Analyzing Stock: {ticker}...")
         score = 0
         report = {"ticker": ticker, "type": "Stock"}
 
         try:
-            # 1. TECHNICAL ANALYSIS (RSI)
-            # multi_level_index=False fixes a common yfinance bug
-            df = yf.download(ticker, period="6mo", interval="1d", progress=False, multi_level_index=False)
+            # 1. FUNDAMENTAL (Market Cap Check) - first, so out-of-zone stocks never download candles
+            if mkt_cap is None:
+                try:
+                    mkt_cap = await asyncio.to_thread(get_market_cap, ticker)
+                except Exception as e:
+                    mkt_cap = e
+            if isinstance(mkt_cap, Exception):
+                # A Yahoo error is not "out of zone": keep the stock, it just misses the cap points
+                print(f"⚠️ Market cap lookup failed for {ticker}: {mkt_cap}")
+                mkt_cap = None
+
+            if mkt_cap is None:
+                report['fundamental'] = "Unknown Cap Size"
+            elif is_moonshot_cap(mkt_cap):
+                score += 20
+                report['fundamental'] = "Moonshot Cap Size"
+            else:
+                print(f"⏭️ {ticker} is outside the Moonshot Zone (Cap: ${mkt_cap:,.0f})")
+                return None
+
+            # 2. TECHNICAL ANALYSIS (RSI)
+            if df is None:
+                import yfinance as yf  # lazy
+                # multi_level_index=False fixes a common yfinance bug
+                df = await asyncio.to_thread(yf.download, ticker, period="6mo", interval="1d", progress=False, multi_level_index=False, session=YF_SESSION)
             if df.empty: return None
             
-            df.ta.rsi(length=14, append=True)
-            current_rsi = df['RSI_14'].iloc[-1]
+            from indicators import _rsi_njit  # lazy: numba only loads once a scan actually runs
+            current_rsi = _rsi_njit(df['Close'].to_numpy(dtype=np.float64), 14)[-1]
             current_price = df['Close'].iloc[-1]
             report['price'] = current_price
             
@@ -117,34 +245,16 @@ class MoonshotAnalyzer:
             else:
                 report['technical'] = f"Neutral/Overheated (RSI: {current_rsi:.2f})"
 
-            # 2. FUNDAMENTAL (Market Cap Check)
-            stock = yf.Ticker(ticker)
-            mkt_cap = stock.info.get('marketCap', 0)
-            
-            # Moonshot Zone: $300M - $20B
-            if 300_000_000 < mkt_cap < 20_000_000_000: 
-                score += 20
-                report['fundamental'] = "Moonshot Cap Size"
-            else:
-                report['fundamental'] = "Cap Size Warning"
-
-            # 3. SENTIMENT (Gemini AI)
-            sent_score, sent_reason = self.get_gemini_sentiment(ticker, "Stock")
-            
-            # Weighted: Sentiment is 50% of a Moonshot score
-            score += (sent_score * 0.5) 
-            report['sentiment'] = f"{sent_reason} ({sent_score}/100)"
-            report['moonshot_score'] = int(score)
-            
-            return report
+            return score, report
 
         except Exception as e:
             print(f"❌ Stock Analysis Failed: {e}")
             return None
 
-    def analyze_crypto(self, ticker):
+    def score_crypto(self, ticker, ohlcv):
         """
-        3-Layer Analysis for Crypto
+        Layers 1 + 2 for Crypto (no Gemini call).
+        Returns (base_score, report), or None without data.
         """
         print(f"🔍 Analyzing Crypto: {ticker}...")
         score = 0
@@ -153,15 +263,18 @@ class MoonshotAnalyzer:
 
         try:
             # 1. TECHNICAL
-            ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe='1d', limit=50)
             if not ohlcv: 
                 print(f"⚠️ Could not fetch data for {symbol} on Binance.")
                 return None
+            ohlcv = ohlcv[-50:]
             
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df.ta.rsi(length=14, append=True)
-            current_rsi = df['RSI_14'].iloc[-1]
-            report['price'] = df['close'].iloc[-1]
+            # Plain ndarray, no DataFrame needed for 50 rows. Columns: ts, open, high, low, close, volume
+            arr = np.asarray(ohlcv, dtype=np.float64)
+            close = arr[:, 4]
+            volume = arr[:, 5]
+            from indicators import _rsi_njit  # lazy
+            current_rsi = _rsi_njit(close, 14)[-1]
+            report['price'] = float(close[-1])
             
             if 45 < current_rsi < 65:
                 score += 30
@@ -173,43 +286,70 @@ class MoonshotAnalyzer:
                 report['technical'] = f"Risky (RSI: {current_rsi:.2f})"
 
             # 2. FUNDAMENTAL (Volume Check)
-            daily_vol = (df['volume'] * df['close']).mean()
+            daily_vol = float((volume * close).mean())
             if daily_vol > 5_000_000:
                 score += 20
                 report['fundamental'] = "High Liquidity"
             else:
                 report['fundamental'] = "Low Liquidity Warning"
 
-            # 3. SENTIMENT (Gemini AI)
-            # Add "Token" to help Gemini find the crypto, not a generic word
-            sent_score, sent_reason = self.get_gemini_sentiment(ticker, "Crypto Token")
-            
-            # Crypto is 60% Sentiment driven
-            score += (sent_score * 0.6)
-            
-            # Cap score at 99
-            final_score = min(int(score), 99)
-            report['sentiment'] = f"{sent_reason} ({sent_score}/100)"
-            report['moonshot_score'] = final_score
-            
-            return report
+            return score, report
 
         except Exception as e:
             print(f"❌ Crypto Error ({symbol}): {e}")
             return None
 
+    def max_score(self, base_score, report):
+        """Best Moonshot score reachable from here, i.e. with a 100/100 sentiment"""
+        weight = CRYPTO_SENTIMENT_WEIGHT if report['type'] == "Crypto" else STOCK_SENTIMENT_WEIGHT
+        return self._final_score(base_score + 100 * weight, report)
+
+    def skip_sentiment(self, base_score, report):
+        """Finishes a report without asking Gemini (used when sentiment can't change the outcome)"""
+        report['sentiment'] = "Skipped (score too low to trade)"
+        report['moonshot_score'] = self._final_score(base_score, report)
+        return report
+
+    async def apply_sentiment(self, base_score, report):
+        """Layer 3: SENTIMENT (Gemini AI). Adds it to the base score and finishes the report."""
+        if report['type'] == "Crypto":
+            # Add "Token" to help Gemini find the crypto, not a generic word
+            sent_score, sent_reason = await self.get_gemini_sentiment(report['ticker'], "Crypto Token")
+            # Crypto is 60% Sentiment driven
+            score = base_score + sent_score * CRYPTO_SENTIMENT_WEIGHT
+        else:
+            sent_score, sent_reason = await self.get_gemini_sentiment(report['ticker'], "Stock")
+            # Weighted: Sentiment is 50% of a Moonshot score
+            score = base_score + sent_score * STOCK_SENTIMENT_WEIGHT
+
+        report['sentiment'] = f"{sent_reason} ({sent_score}/100)"
+        report['moonshot_score'] = self._final_score(score, report)
+        return report
+
+    def _final_score(self, score, report):
+        # Cap crypto score at 99
+        if report['type'] == "Crypto":
+            return min(int(score), 99)
+        return int(score)
+
 # Test the Engine
-if __name__ == "__main__":
+async def _test():
     analyzer = MoonshotAnalyzer()
     
     # Test 1: Stock (Space Stock)
     print("\n--- TEST 1: STOCK (RKLB) ---")
-    result = analyzer.analyze_stock("RKLB") # Rocket Lab
+    result = await analyzer.analyze_stock("RKLB") # Rocket Lab
     if result: print(json.dumps(result, indent=2))
     
     print("-" * 30)
     
     # Test 2: Crypto (AI Token)
     print("\n--- TEST 2: CRYPTO (FET) ---")
-    result = analyzer.analyze_crypto("FET") # Fetch.ai
-    if result: print(json.dumps(result, indent=2))
\ No newline at end of file
+    ohlcv = await analyzer.fetch_crypto_ohlcv(["FET"])
+    result = await analyzer.analyze_crypto("FET", ohlcv["FET"]) # Fetch.ai
+    if result: print(json.dumps(result, indent=2))
+
+    await analyzer.close()
+
+if __name__ == "__main__":
+    asyncio.run(_test())
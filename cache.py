@@ -0,0 +1,46 @@
+import os
+import time
+import hashlib
+import threading
+import orjson
+
+CACHE_DIR = ".cache"
+
+def make_key(*parts):
+    """Stable filename-safe key for any combination of values"""
+    return hashlib.md5(":".join(str(p) for p in parts).encode()).hexdigest()
+
+class FileCache:
+    """
+    Tiny TTL cache that keeps JSON blobs on disk, so it survives bot restarts.
+    Each namespace gets its own folder: .cache/<namespace>/<key>.json
+    """
+    def __init__(self, namespace):
+        self.cache_dir = os.path.join(CACHE_DIR, namespace)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key, ttl):
+        """Returns cached data, or None if missing / older than `ttl` seconds"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                blob = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+
+        if time.time() - blob.get('ts', 0) > ttl:
+            return None
+        return blob.get('data')
+
+    def set(self, key, data):
+        path = self._path(key)
+        # Write to a temp file first so a concurrent reader never sees half a blob
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(orjson.dumps({"ts": time.time(), "data": data}))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Cache Write Failed ({path}): {e}")
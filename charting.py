@@ -1,10 +1,133 @@
-import yfinance as yf
-import mplfinance as mpf
-import pandas as pd
-import ccxt
+import numpy as np
 import os
+import time
 import shutil
 
+# Crypto charts show the last 90 daily candles
+CHART_CANDLES = 90
+# Charts younger than this are reused instead of redrawn (re-runs within a scan hit this)
+CHART_MAX_AGE = 3600
+
+# Reused between renders (one per chart worker process) to skip Figure setup
+_figure = None
+
+def _headless():
+    """Agg backend, set before anything imports pyplot. Called lazily: matplotlib stays off the bot's startup path."""
+    import matplotlib
+    matplotlib.use('Agg') # Headless backend (also skips GUI init in chart worker processes)
+
+def _ohlcv_arrays(df):
+    """Open/High/Low/Close/Volume as float arrays (stock frames are Title-case, crypto lower-case)"""
+    columns = {c.lower(): c for c in df.columns}
+    return [df[columns[name]].to_numpy(dtype=np.float64) for name in ('open', 'high', 'low', 'close', 'volume')]
+
+def _moving_average(close, window):
+    """Simple MA via np.convolve, NaN-padded to len(close) (first window-1 bars have no value)"""
+    ma = np.full(len(close), np.nan)
+    if len(close) >= window:
+        ma[window - 1:] = np.convolve(close, np.ones(window) / window, mode='valid')
+    return ma
+
+def _fast_plot(df, title, filename, style):
+    """
+    Draws our one fixed layout (candles + MA20/MA50 + volume) straight with matplotlib.
+    Wicks and bodies are single collections, so there is no per-candle work.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.collections import LineCollection, PolyCollection
+
+    global _figure
+    if _figure is None:
+        _figure = Figure(figsize=(8, 5.75))
+    fig = _figure
+    fig.clear()
+
+    o, h, l, c, v = _ohlcv_arrays(df)
+    n = len(c)
+    x = np.arange(n)
+
+    # Colors from the mpf style, so both render paths look the same
+    market = style.get('marketcolors', {})
+    up = market.get('candle', {}).get('up', '#00ff00')
+    down = market.get('candle', {}).get('down', '#ff0000')
+    colors = np.where(c >= o, up, down)
+    face = style.get('facecolor', '#0e1117')
+    grid = style.get('gridcolor', '#23262c')
+    mav_colors = style.get('mavcolors', ['#40e0d0', '#ff00ff'])
+
+    fig.set_facecolor(face)
+    ax = fig.add_axes([0.1, 0.32, 0.86, 0.58])
+    ax_vol = fig.add_axes([0.1, 0.08, 0.86, 0.22], sharex=ax)
+    for axis in (ax, ax_vol):
+        axis.set_facecolor(face)
+        axis.grid(color=grid, linestyle='--')
+        axis.tick_params(colors='white')
+        for spine in axis.spines.values():
+            spine.set_color(grid)
+
+    # Candles: one LineCollection for wicks, one PolyCollection for bodies
+    ax.add_collection(LineCollection(np.stack([np.column_stack([x, l]), np.column_stack([x, h])], axis=1), colors=colors, linewidths=1))
+    bottom = np.minimum(o, c)
+    top = np.maximum(o, c)
+    bodies = np.stack([
+        np.column_stack([x - 0.3, bottom]), np.column_stack([x - 0.3, top]),
+        np.column_stack([x + 0.3, top]), np.column_stack([x + 0.3, bottom]),
+    ], axis=1)
+    ax.add_collection(PolyCollection(bodies, facecolors=colors, edgecolors=colors, linewidths=0.5))
+
+    for window, color in zip((20, 50), mav_colors):
+        if n >= window:
+            ax.plot(x, _moving_average(c, window), color=color, linewidth=1)
+
+    ax.set_xlim(-1, n)
+    ax.set_ylim(np.nanmin(l) * 0.98, np.nanmax(h) * 1.02)
+    ax.set_ylabel('Price ($)', color='white')
+    ax.set_title(f"\n{title} (Daily)", color='white', fontsize='x-large', fontweight='bold')
+    ax.tick_params(labelbottom=False)
+
+    ax_vol.bar(x, v, color=colors, width=0.6)
+    ax_vol.set_ylabel('Volume', color='white')
+    ax_vol.yaxis.get_offset_text().set_color('white')
+    ticks = np.linspace(0, n - 1, min(n, 6)).astype(int)
+    ax_vol.set_xticks(ticks)
+    ax_vol.set_xticklabels([df.index[i].strftime('%b %d') for i in ticks])
+
+    fig.savefig(filename, dpi=100, bbox_inches='tight', facecolor=face)
+
+def render_chart(df, title, filename, style):
+    """
+    Draws + saves one chart. Top-level (picklable) so it can run in a ProcessPoolExecutor.
+    Returns the filename.
+    """
+    if os.path.exists(filename) and time.time() - os.path.getmtime(filename) < CHART_MAX_AGE:
+        print(f"♻️ Reusing chart: {filename}")
+        return filename
+
+    _headless()
+    try:
+        _fast_plot(df, title, filename, style)
+    except Exception as e:
+        # mplfinance is slower but handles anything odd about the data
+        print(f"⚠️ Fast chart failed ({e}), falling back to mplfinance...")
+        import mplfinance as mpf
+        # MAs precomputed with NumPy instead of mav=(20, 50), which runs pandas rolling() per window
+        close = _ohlcv_arrays(df)[3]
+        mavs = [mpf.make_addplot(_moving_average(close, window), color=color)
+                for window, color in ((20, 'cyan'), (50, 'magenta')) if len(close) >= window]
+        mpf.plot(
+            df,
+            type='candle',
+            style=style,
+            title=f"\n{title} (Daily)",
+            ylabel='Price ($)',
+            volume=True,
+            addplot=mavs or None,
+            savefig=dict(fname=filename, dpi=100, bbox_inches='tight'),
+            tight_layout=True
+        )
+    print(f"✅ Saved chart to: {filename}")
+    return filename
+
 class ChartGenerator:
     def __init__(self):
         # 1. Create the 'charts' folder if it doesn't exist
@@ -13,68 +136,96 @@ class ChartGenerator:
             os.makedirs(self.chart_dir)
             print(f"📁 Created directory: {self.chart_dir}")
 
-        self.exchange = ccxt.binance()
-        
-        # Dark Mode Style
-        self.style = mpf.make_mpf_style(
-            base_mpf_style='nightclouds', 
-            facecolor='#0e1117',
-            edgecolor='#0e1117',
-            gridcolor='#23262c',
-            marketcolors=mpf.make_marketcolors(
-                up='#00ff00', down='#ff0000',
-                edge='inherit', wick='inherit', volume='in'
+        # ccxt / mplfinance are heavy: both get built on first use, not at bot startup
+        self._exchange = None
+        self._style = None
+
+    @property
+    def exchange(self):
+        if self._exchange is None:
+            import ccxt
+            self._exchange = ccxt.binance()
+        return self._exchange
+
+    @property
+    def style(self):
+        if self._style is None:
+            _headless()
+            import mplfinance as mpf
+            # Dark Mode Style
+            self._style = mpf.make_mpf_style(
+                base_mpf_style='nightclouds', 
+                facecolor='#0e1117',
+                edgecolor='#0e1117',
+                gridcolor='#23262c',
+                marketcolors=mpf.make_marketcolors(
+                    up='#00ff00', down='#ff0000',
+                    edge='inherit', wick='inherit', volume='in'
+                )
             )
-        )
+        return self._style
+
+    def generate_stock_chart(self, ticker, df=None):
+        """Generates a chart for stocks (pass `df` to reuse candles already downloaded)"""
+        job = self.prepare_stock_chart(ticker, df)
+        return self._plot_and_save(*job) if job else None
+
+    def generate_crypto_chart(self, ticker, ohlcv=None):
+        """Generates a chart for crypto (pass `ohlcv` to reuse candles already fetched)"""
+        job = self.prepare_crypto_chart(ticker, ohlcv)
+        return self._plot_and_save(*job) if job else None
 
-    def generate_stock_chart(self, ticker):
-        """Generates a chart for stocks"""
+    def prepare_stock_chart(self, ticker, df=None):
+        """Returns the render_chart() arguments for a stock, or None if there is no data"""
+        import pandas as pd  # lazy, like yfinance below
         try:
             print(f"🎨 Painting chart for Stock: {ticker}...")
-            df = yf.download(ticker, period="3mo", interval="1d", progress=False, multi_level_index=False)
+            if df is None:
+                import yfinance as yf
+                # Same session as the analyzer: yfinance keeps ONE global session + crumb, a second one breaks it
+                from analysis_engine import YF_SESSION
+                df = yf.download(ticker, period="3mo", interval="1d", progress=False, multi_level_index=False, session=YF_SESSION)
             if df.empty: return None
+            # Longer histories (e.g. the analyzer's 6mo) get trimmed to the same 3mo window
+            df = df[df.index >= df.index[-1] - pd.DateOffset(months=3)]
 
             # Save to charts/TICKER_chart.png
             filename = os.path.join(self.chart_dir, f"{ticker}_chart.png")
-            self._plot_and_save(df, ticker, filename)
-            return filename
+            return df, ticker, filename, self.style
         except Exception as e:
             print(f"❌ Chart Error ({ticker}): {e}")
             return None
 
-    def generate_crypto_chart(self, ticker):
-        """Generates a chart for crypto"""
+    def prepare_crypto_chart(self, ticker, ohlcv=None):
+        """Returns the render_chart() arguments for a crypto, or None if there is no data"""
+        import pandas as pd  # lazy
         try:
             print(f"🎨 Painting chart for Crypto: {ticker}...")
             symbol = f"{ticker.upper()}/USDT"
-            ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe='1d', limit=90)
+            if ohlcv is None:
+                ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe='1d', limit=CHART_CANDLES)
             if not ohlcv: return None
+            ohlcv = ohlcv[-CHART_CANDLES:]
             
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('timestamp', inplace=True)
+            # Typed columns + a ready-made DatetimeIndex: no dtype inference, no pd.to_datetime pass
+            arr = np.asarray(ohlcv, dtype=np.float64)
+            idx = pd.DatetimeIndex(arr[:, 0].astype('int64') * 1_000_000, name='timestamp')
+            df = pd.DataFrame({'Open': arr[:, 1], 'High': arr[:, 2], 'Low': arr[:, 3],
+                               'Close': arr[:, 4], 'Volume': arr[:, 5]}, index=idx, copy=False)
 
             # Save to charts/TICKER_crypto.png
             filename = os.path.join(self.chart_dir, f"{ticker}_crypto.png")
-            self._plot_and_save(df, symbol, filename)
-            return filename
+            return df, symbol, filename, self.style
         except Exception as e:
             print(f"❌ Crypto Chart Error: {e}")
             return None
 
-    def _plot_and_save(self, df, title, filename):
-        mpf.plot(
-            df,
-            type='candle',
-            style=self.style,
-            title=f"\n{title} (Daily)",
-            ylabel='Price ($)',
-            volume=True,
-            mav=(20, 50),
-            savefig=dict(fname=filename, dpi=100, bbox_inches='tight'),
-            tight_layout=True
-        )
-        print(f"✅ Saved chart to: {filename}")
+    def _plot_and_save(self, df, title, filename, style):
+        try:
+            return render_chart(df, title, filename, style)
+        except Exception as e:
+            print(f"❌ Chart Error ({title}): {e}")
+            return None
 
     def cleanup_chart(self, filepath):
         """Utility to delete a specific chart after sending"""
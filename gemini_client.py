@@ -0,0 +1,61 @@
+import os
+import sys
+import re
+from contextlib import aclosing
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+
+# 1. Load Keys
+load_dotenv()
+api_key = os.getenv("GEMINI_API_KEY")
+
+if not api_key:
+    print("❌ Error: GEMINI_API_KEY not found in .env file!")
+    sys.exit()
+
+# 2. One shared client for the whole bot, so scout/sentiment/strategy reuse its connections
+try:
+    client = genai.Client(api_key=api_key, http_options=types.HttpOptions(timeout=30_000))
+    print("✅ Client initialized.")
+except Exception as e:
+    print(f"❌ Error initializing client: {e}")
+    sys.exit()
+
+MODEL = "models/gemini-2.5-flash-lite"
+
+# Google Search grounding, shared by every call that reads the live internet
+GROUNDING_TOOL = types.Tool(google_search=types.GoogleSearch())
+
+# A complete fenced ```json block
+JSON_BLOCK_RE = re.compile(r"```json\s*([\s\S]*?)\s*```")
+
+def strip_fences(text):
+    """
+    The JSON part of a Gemini reply, as bytes ready for orjson.
+    First ```json block if there is one, else the whole text minus stray backticks.
+    Slices instead of regex / .replace() chains, so no extra string copies.
+    """
+    start = text.find('```json')
+    if start != -1:
+        start += 7
+        end = text.find('```', start)
+        return text[start:end if end != -1 else None].strip().encode()
+    return text.strip().strip('`').encode()
+
+async def stream_until_json(contents, config=None):
+    """
+    Streams a Gemini reply and stops as soon as a complete ```json block has arrived.
+    Returns (text, last_chunk) - the chunk keeps finish_reason / safety ratings for debugging.
+    """
+    text = ""
+    last_chunk = None
+    stream = await client.aio.models.generate_content_stream(model=MODEL, contents=contents, config=config)
+    async with aclosing(stream):
+        async for chunk in stream:
+            last_chunk = chunk
+            if chunk.text:
+                text += chunk.text
+                if JSON_BLOCK_RE.search(text):
+                    break
+    return text, last_chunk
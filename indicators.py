@@ -0,0 +1,37 @@
+import numpy as np
+
+# Numba is optional: without it the same code just runs as plain Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# NOTE: no fastmath here - it assumes NaN never happens, and the warm-up bars ARE NaN
+@njit(cache=True)
+def _rsi_njit(close, length):
+    """
+    RSI with Wilder smoothing (alpha = 1/length), same numbers as pandas_ta's rsi().
+    First `length` values are NaN while the averages warm up.
+    """
+    n = close.shape[0]
+    out = np.full(n, np.nan)
+    decay = 1.0 - 1.0 / length
+
+    # The EWM weights cancel out in gain / (gain + loss), so only the decayed sums are needed
+    gain_sum = 0.0
+    loss_sum = 0.0
+    for i in range(1, n):
+        change = close[i] - close[i - 1]
+        gain = change if change > 0.0 else 0.0
+        loss = -change if change < 0.0 else 0.0
+        gain_sum = gain + decay * gain_sum
+        loss_sum = loss + decay * loss_sum
+
+        if i >= length:
+            total = gain_sum + loss_sum
+            if total > 0.0:
+                out[i] = 100.0 * gain_sum / total
+    return out
@@ -1,8 +1,10 @@
 import os
-import json
 import logging
 import asyncio
-import yfinance as yf
+import multiprocessing
+import orjson
+import aiofiles
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, JobQueue
@@ -12,26 +14,22 @@ import ai_scout
 import analysis_engine
 import charting
 import paper_trader
-from google import genai
+from gemini_client import client, MODEL, strip_fences
 
 # 1. SETUP & CONFIGURATION
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 CHAT_ID = "YOUR_CHAT_ID_HERE" # OPTIONAL: Set this if you know it, otherwise /start sets it.
 
-# Initialize Systems
-trader = paper_trader.PaperTrader(initial_cash=10000.0)
-analyzer = analysis_engine.MoonshotAnalyzer()
-artist = charting.ChartGenerator()
-
-# Initialize Strategist (Gemini)
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Initialize Systems (in on_startup, NOT at import: chart workers may re-import this file)
+trader = None
+analyzer = None
+artist = None
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
 # --- STRATEGIST LOGIC (The "Portfolio Manager" AI) ---
-def get_ai_strategy(ticker, narrative, analysis_report, current_cash, current_exposure):
+async def get_ai_strategy(ticker, narrative, analysis_report, current_cash, current_exposure):
     prompt = f"""
     Act as a Hedge Fund Portfolio Manager.
     
@@ -61,12 +59,12 @@ def get_ai_strategy(ticker, narrative, analysis_report, current_cash, current_ex
     }}
     """
     try:
-        response = client.models.generate_content(
-            model="models/gemini-2.5-flash-lite", 
+        response = await client.aio.models.generate_content(
+            model=MODEL, 
             contents=prompt
         )
-        text = response.text.replace('```json', '').replace('```', '').strip()
-        return json.loads(text)
+        strategy = orjson.loads(strip_fences(response.text))
+        return strategy if isinstance(strategy, dict) else None
     except Exception as e:
         print(f"Strategy Error: {e}")
         return None
@@ -87,6 +85,9 @@ async def portfolio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg, parse_mode='Markdown')
 
 async def manual_scan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if scan_lock.locked():
+        await update.message.reply_text("⏳ A scan is already running, results will arrive shortly.")
+        return
     await update.message.reply_text("🔎 Force Scan Initiated... This may take a minute.")
     await run_market_scan(context)
 
@@ -117,8 +118,9 @@ async def cmd_sell_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if stocks:
         tickers = [s[0] for s in stocks]
         try:
+            import yfinance as yf  # lazy: keeps bot startup fast
             # Fetch all prices at once for speed
-            data = yf.download(tickers, period="1d", progress=False)['Close'].iloc[-1]
+            data = yf.download(tickers, period="1d", progress=False, session=analysis_engine.YF_SESSION)['Close'].iloc[-1]
             
             for ticker, qty, avg in stocks:
                 # Handle single vs multiple ticker result format
@@ -134,16 +136,17 @@ async def cmd_sell_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     exchange = analyzer.exchange # Re-use the analyzer's connection
     for ticker, qty, avg in cryptos:
         try:
-            price = exchange.fetch_ticker(ticker)['last']
+            price = (await exchange.fetch_ticker(ticker))['last']
             val = qty * price
             total_liquidation_value += val
             log += f"📉 Sold {ticker}: ${val:,.2f} (@ ${price:.2f})\n"
         except Exception as e:
             log += f"⚠️ Error selling {ticker}: {e}\n"
 
-    # 4. UPDATE DATABASE
-    trader.deposit_cash(total_liquidation_value)
-    trader.clear_positions()
+    # 4. UPDATE DATABASE (deposit + wipe land together, in one transaction)
+    with trader.batch():
+        trader.deposit_cash(total_liquidation_value)
+        trader.clear_positions()
     
     final_balance = trader.get_balance()
     
@@ -173,71 +176,189 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             description = handler.callback.__doc__ or "No description."
             
             msg += f"/{command_name} - {description}\n"
+
+    # Show when the scheduled scan fires next
+    for job in context.job_queue.get_jobs_by_name("market_scan"):
+        msg += f"\n⏰ Next auto-scan: {job.next_t:%Y-%m-%d %H:%M} UTC\n"
             
     await update.message.reply_text(msg, parse_mode='Markdown')
 
 # --- THE MAIN LOOP (The "Job") ---
+# Only candidates scoring at least this get traded
+MIN_TRADE_SCORE = 70
+# Max sentiment checks in flight at once (respects the Gemini rate limit)
+gemini_slots = asyncio.Semaphore(5)
+# Chart rendering is CPU-bound, so it gets real processes instead of threads (created in on_startup)
+chart_pool = None
+# Held for the whole scan (scheduled or /scan)
+scan_lock = asyncio.Lock()
+
+def prefetch_stock_data(tickers):
+    """Downloads 6mo of daily candles for all stocks in ONE request. Returns {TICKER: df}"""
+    if not tickers: return {}
+    import yfinance as yf  # lazy: keeps bot startup fast
+    try:
+        data = yf.download(tickers, period="6mo", interval="1d", group_by='ticker', threads=True, progress=False, session=analysis_engine.YF_SESSION)
+    except Exception as e:
+        print(f"⚠️ Bulk Download Failed: {e}")
+        return {}
+
+    frames = {}
+    for ticker in tickers:
+        # yfinance upper-cases symbols; missing ones just fall back to a single download
+        if ticker.upper() in data.columns.get_level_values(0):
+            frames[ticker] = data[ticker.upper()].dropna(how='all')
+    return frames
+
+async def analyze_candidate(item, data=None, mkt_cap=None):
+    """
+    Analyzes a single candidate. Returns (report, chart_file).
+    `data` is the prefetched df (stocks) or ohlcv list (crypto), `mkt_cap` the pre-filter's cap lookup (stocks).
+    Only candidates that can still reach MIN_TRADE_SCORE get a chart, drawn while sentiment loads.
+    """
+    ticker = item.get('ticker')
+    asset_type = item.get('type', 'Stock') # Default to Stock if missing
+
+    print(f"👉 Checking {ticker} ({asset_type})...")
+
+    if asset_type == 'Crypto':
+        scored = analyzer.score_crypto(ticker, data)
+    else:
+        scored = await analyzer.score_stock(ticker, data, mkt_cap)
+    if not scored: return None, None
+
+    # Sentiment is the slowest step - skip it (and the chart) when even a perfect vibe can't reach the trade threshold
+    if analyzer.max_score(*scored) < MIN_TRADE_SCORE:
+        print(f"⏭️ {ticker} can't reach {MIN_TRADE_SCORE}, skipping sentiment.")
+        return analyzer.skip_sentiment(*scored), None
+
+    async def sentiment():
+        async with gemini_slots:
+            return await analyzer.apply_sentiment(*scored)
+
+    report, chart_file = await asyncio.gather(sentiment(), draw_chart(item, data), return_exceptions=True)
+    if isinstance(report, BaseException):
+        # Don't leave the chart behind when the analysis itself blew up
+        if isinstance(chart_file, str): artist.cleanup_chart(chart_file)
+        raise report
+    if isinstance(chart_file, BaseException):
+        print(f"❌ Chart Error ({ticker}): {chart_file}")
+        chart_file = None
+    return report, chart_file
+
+async def draw_chart(item, data=None):
+    """Renders the candidate's chart in the process pool, alongside its sentiment check"""
+    ticker = item.get('ticker')
+    if data is None: return None # Nothing prefetched (unlisted / failed download), don't fetch it again
+    if item.get('type') == 'Crypto':
+        job = await asyncio.to_thread(artist.prepare_crypto_chart, ticker, data)
+    else:
+        job = await asyncio.to_thread(artist.prepare_stock_chart, ticker, data)
+    if not job: return None
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(chart_pool, charting.render_chart, *job)
+    except Exception as e:
+        print(f"❌ Chart Error ({ticker}): {e}")
+        return None
+
 async def run_market_scan(context: ContextTypes.DEFAULT_TYPE):
+    # A stalled scan (Gemini rate limits, slow Binance) must not get a second one stacked on top
+    if scan_lock.locked():
+        print("⏭️ Previous scan still running; skipping tick.")
+        return
+    async with scan_lock:
+        await _market_scan(context)
+
+async def _market_scan(context: ContextTypes.DEFAULT_TYPE):
     print("--- 🔄 Starting Market Scan ---")
     
     # 1. SCOUT
-    candidates = ai_scout.scan_market()
+    candidates = await ai_scout.scan_market()
     if isinstance(candidates, str): 
         print(candidates) # Print error if string
         return
 
-    for item in candidates:
-        ticker = item.get('ticker')
-        narrative = item.get('narrative')
-        asset_type = item.get('type', 'Stock') # Default to Stock if missing
-        
-        print(f"👉 Checking {ticker} ({asset_type})...")
-        
-        # 2. ANALYZE & CHART
-        chart_file = None # Initialize variable
-        if asset_type == 'Crypto':
-            report = analyzer.analyze_crypto(ticker)
-            if report:
-                chart_file = artist.generate_crypto_chart(ticker)
-        else:
-            report = analyzer.analyze_stock(ticker)
-            if report:
-                chart_file = artist.generate_stock_chart(ticker)
-
-        if not report: continue
-
-        score = report.get('moonshot_score', 0)
-        print(f"📊 Score for {ticker}: {score}/100")
-
-        # 3. FILTER (Only trade if Score > 70)
-        if score >= 70:
-            # 4. STRATEGY
-            cash = trader.get_balance()
-            exposure = trader.get_position_exposure(ticker)
+    # 2. ANALYZE & CHART (All candidates at once)
+    stocks = [c['ticker'] for c in candidates if c.get('type', 'Stock') != 'Crypto' and c.get('ticker')]
+    cryptos = [c['ticker'] for c in candidates if c.get('type') == 'Crypto' and c.get('ticker')]
+
+    # Cap check first (cached fast_info): out-of-zone stocks are dropped before any candles are downloaded
+    caps = await asyncio.gather(*[asyncio.to_thread(analysis_engine.get_market_cap, t) for t in stocks], return_exceptions=True)
+    # Failed lookups are kept (scored without the cap points), only real out-of-zone caps are dropped
+    failed = [t for t, cap in zip(stocks, caps) if isinstance(cap, Exception)]
+    if failed:
+        print(f"⚠️ Market cap lookup failed (kept): {', '.join(failed)}")
+    # Handed to score_stock, so nothing is looked up twice (failed lookups aren't memoized)
+    stock_caps = dict(zip(stocks, caps))
+    rejected = {t for t, cap in zip(stocks, caps) if not isinstance(cap, Exception) and not analysis_engine.is_moonshot_cap(cap)}
+    if rejected:
+        print(f"⏭️ Outside the Moonshot Zone: {', '.join(rejected)}")
+        stocks = [t for t in stocks if t not in rejected]
+        candidates = [c for c in candidates if c.get('type') == 'Crypto' or c.get('ticker') not in rejected]
+
+    # Stocks: one bulk download. Crypto: every fetch_ohlcv in flight at once.
+    # Each download is shared by the analyzer and the chart (crypto fetches the longer chart window).
+    stock_data, crypto_data = await asyncio.gather(
+        asyncio.to_thread(prefetch_stock_data, stocks),
+        analyzer.fetch_crypto_ohlcv(cryptos, limit=charting.CHART_CANDLES)
+    )
+
+    def prefetched(item):
+        source = crypto_data if item.get('type') == 'Crypto' else stock_data
+        return source.get(item.get('ticker'))
+
+    results = await asyncio.gather(
+        *[analyze_candidate(item, prefetched(item), stock_caps.get(item.get('ticker'))) for item in candidates],
+        return_exceptions=True
+    )
+
+    try:
+        for item, result in zip(candidates, results):
+            ticker = item.get('ticker')
+            narrative = item.get('narrative')
+
+            if isinstance(result, Exception):
+                print(f"❌ Analysis Failed ({ticker}): {result}")
+                continue
+
+            report, chart_file = result
+            if not report: continue
+
+            score = report.get('moonshot_score', 0)
+            print(f"📊 Score for {ticker}: {score}/100")
+
+            # 3. FILTER (Only trade if Score > 70)
+            if score >= MIN_TRADE_SCORE:
+                # 4. STRATEGY
+                cash = trader.get_balance()
+                exposure = trader.get_position_exposure(ticker)
             
-            strategy = get_ai_strategy(ticker, narrative, str(report), cash, exposure)
-            if not strategy: continue
+                strategy = await get_ai_strategy(ticker, narrative, str(report), cash, exposure)
+                if not strategy: continue
             
-            # 5. EXECUTE (Paper Trade)
-            trade_log = ""
-            current_price = report.get('price', 0)
+                # 5. EXECUTE (Paper Trade)
+                trade_log = ""
+                current_price = report.get('price', 0)
             
-            # Execute Trades (Spot, Limit, Stop)
-            if strategy.get('spot_pct', 0) > 0:
-                spot_amt = cash * (strategy['spot_pct'] / 100)
-                if spot_amt > 10:
-                    trade_log += f"{trader.execute_trade(ticker, 'BUY', current_price, spot_amt)}\n"
+                # Execute Trades (Spot, Limit, Stop) - one DB transaction, one commit
+                with trader.batch():
+                    if strategy.get('spot_pct', 0) > 0:
+                        spot_amt = cash * (strategy['spot_pct'] / 100)
+                        if spot_amt > 10:
+                            trade_log += f"{trader.execute_trade(ticker, 'BUY', current_price, spot_amt)}\n"
             
-            if strategy.get('limit_pct', 0) > 0:
-                limit_amt = cash * (strategy['limit_pct'] / 100)
-                if limit_amt > 10:
-                    trade_log += f"{trader.log_pending_order(ticker, 'LIMIT_BUY', strategy['limit_price'], limit_amt)}\n"
+                    if strategy.get('limit_pct', 0) > 0:
+                        limit_amt = cash * (strategy['limit_pct'] / 100)
+                        if limit_amt > 10:
+                            trade_log += f"{trader.log_pending_order(ticker, 'LIMIT_BUY', strategy['limit_price'], limit_amt)}\n"
                 
-            trader.log_pending_order(ticker, "STOP_LOSS", strategy['stop_loss'], 0)
+                    trader.log_pending_order(ticker, "STOP_LOSS", strategy['stop_loss'], 0)
 
-            # 6. NOTIFY
-            # We remove the bolding formatting logic here to prevent crashes
-            caption = f"""
+                # 6. NOTIFY
+                # We remove the bolding formatting logic here to prevent crashes
+                caption = f"""
 🚀 MOONSHOT FOUND: {ticker}
 Score: {score}/100
 🔥 Narrative: {narrative}
@@ -252,22 +373,51 @@ Reason: {strategy['reason']}
 🛑 Stop Loss: ${strategy['stop_loss']}
             """
             
-            # FIX: Removed parse_mode='Markdown' to prevent crashes from AI symbols
-            if CHAT_ID:
-                if chart_file and os.path.exists(chart_file):
-                    await context.bot.send_photo(chat_id=CHAT_ID, photo=open(chart_file, 'rb'), caption=caption)
-                else:
-                    await context.bot.send_message(chat_id=CHAT_ID, text=caption)
+                # FIX: Removed parse_mode='Markdown' to prevent crashes from AI symbols
+                if CHAT_ID:
+                    try:
+                        if chart_file and os.path.exists(chart_file):
+                            # Async read so polling isn't blocked on disk, and the handle is always closed
+                            async with aiofiles.open(chart_file, 'rb') as f:
+                                photo_bytes = await f.read()
+                            await context.bot.send_photo(chat_id=CHAT_ID, photo=photo_bytes, caption=caption)
+                        else:
+                            await context.bot.send_message(chat_id=CHAT_ID, text=caption)
+                    finally:
+                        artist.cleanup_chart(chart_file)
+    finally:
+        # Every chart this scan rendered goes, traded or not (a leftover would be reused next scan)
+        for result in results:
+            if isinstance(result, tuple): artist.cleanup_chart(result[1])
 
     print("--- ✅ Scan Complete ---")
 
+async def on_startup(app):
+    global trader, analyzer, artist, chart_pool
+    # 1. Chart workers FIRST, while the bot has no threads yet: a fork can't inherit a held lock.
+    # fork also means workers never re-import this file; spawn is only the fallback (Windows)
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    chart_pool = ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context(method))
+    # No-op task: with fork, every worker is started right here instead of mid-scan
+    await asyncio.get_running_loop().run_in_executor(chart_pool, os.getpid)
+
+    # 2. Everything else
+    trader = paper_trader.PaperTrader(initial_cash=10000.0)
+    analyzer = analysis_engine.MoonshotAnalyzer()
+    artist = charting.ChartGenerator()
+
+async def on_shutdown(app):
+    if analyzer: await analyzer.close()
+    if chart_pool: chart_pool.shutdown(wait=False, cancel_futures=True)
+    if trader: trader.close()
+
 # --- LAUNCHER ---
 if __name__ == '__main__':
     if not TELEGRAM_TOKEN:
         print("Error: TELEGRAM_TOKEN not set in .env")
         exit()
         
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = ApplicationBuilder().token(TELEGRAM_TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
     
     # [Update the add_handler section in main.py]
     
@@ -284,7 +434,7 @@ if __name__ == '__main__':
     
     # Schedule Job (Every 4 hours = 14400 seconds)
     job_queue = app.job_queue
-    job_queue.run_repeating(run_market_scan, interval=14400, first=10)
+    job_queue.run_repeating(run_market_scan, interval=14400, first=10, name="market_scan")
     
     print("🤖 Bot is Live! Polling...")
     app.run_polling()
\ No newline at end of file
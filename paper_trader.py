@@ -1,122 +1,345 @@
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Every runtime query lives here, so each one is a single string object that
+# sqlite3's statement cache keeps prepared instead of re-parsing per call
+# The wallet is a single row (id=1), so every wallet query is a direct rowid lookup
+_SQL_GET_BALANCE = "SELECT balance FROM wallet WHERE id=1"
+# Funds check + debit in one atomic statement: rowcount 0 means not enough cash
+_SQL_DEBIT = "UPDATE wallet SET balance = balance - ? WHERE id=1 AND balance >= ?"
+_SQL_DEPOSIT = "UPDATE wallet SET balance = balance + ? WHERE id=1"
+_SQL_SEED_WALLET = "INSERT OR IGNORE INTO wallet (id, balance) VALUES (1, ?)"
+_SQL_RESET_WALLET = "INSERT OR REPLACE INTO wallet (id, balance) VALUES (1, ?)"
+_SQL_CREATE_WALLET = "CREATE TABLE IF NOT EXISTS wallet (id INTEGER PRIMARY KEY CHECK(id=1), balance REAL NOT NULL)"
+_SQL_GET_HOLDINGS = "SELECT ticker, amount, avg_cost FROM positions WHERE amount > 0"
+# `exposure` (amount * avg_cost) is a STORED generated column: computed on write, read as a plain value
+_SQL_CREATE_POSITIONS = """CREATE TABLE IF NOT EXISTS positions (ticker TEXT PRIMARY KEY, amount REAL, avg_cost REAL,
+    exposure REAL GENERATED ALWAYS AS (amount * avg_cost) STORED)"""
+_SQL_GET_EXPOSURE = "SELECT COALESCE(exposure, 0.0) FROM positions WHERE ticker=?"
+_SQL_GET_ALL_EXPOSURES = "SELECT ticker, exposure FROM positions WHERE amount > 0 ORDER BY exposure DESC"
+# New ticker -> insert; existing -> add the shares and re-average the cost, all in one statement
+_SQL_UPSERT_POSITION = """INSERT INTO positions (ticker, amount, avg_cost) VALUES (?, ?, ?)
+    ON CONFLICT(ticker) DO UPDATE SET
+        avg_cost = ((amount * avg_cost) + excluded.amount * excluded.avg_cost) / (amount + excluded.amount),
+        amount = amount + excluded.amount"""
+_SQL_GET_OPEN_ORDERS = "SELECT ticker, type, target_price, amount FROM orders WHERE status='OPEN'"
+_SQL_OPEN_ORDER_TICKERS = "SELECT DISTINCT ticker FROM orders WHERE status='OPEN'"
+# Limit Buy and Stop Loss both trigger once price drops BELOW target, so SQLite can do all the matching
+_SQL_MATCH_TICKER_ORDERS = """SELECT id, ticker, type, target_price, amount FROM orders
+    WHERE ticker=? AND status='OPEN' AND type IN ('LIMIT_BUY', 'STOP_LOSS') AND target_price >= ?"""
+_SQL_HAS_OPEN_ORDERS = "SELECT 1 FROM orders WHERE ticker=? AND status='OPEN' LIMIT 1"
+# Every triggered order for a whole tick; {values} becomes one "(?, ?)" per (ticker, price)
+_SQL_MATCH_PENDING = """WITH px(ticker, price) AS (VALUES {values})
+    SELECT o.id, o.ticker, o.type, o.target_price, o.amount FROM orders o JOIN px ON px.ticker = o.ticker
+    WHERE o.status='OPEN' AND o.type IN ('LIMIT_BUY', 'STOP_LOSS') AND px.price <= o.target_price"""
+_SQL_INSERT_ORDER = "INSERT INTO orders (ticker, type, target_price, amount, status) VALUES (?, ?, ?, ?, 'OPEN')"
+_SQL_FILL_ORDER = "UPDATE orders SET status='FILLED' WHERE id=?"
+_SQL_TRIGGER_ORDER = "UPDATE orders SET status='TRIGGERED' WHERE id=?"
+# Closed orders move to closed_orders, so the hot `orders` table only ever holds a handful of rows
+_SQL_ARCHIVE_ORDERS = "INSERT INTO closed_orders SELECT * FROM orders WHERE status IN ('FILLED', 'TRIGGERED')"
+_SQL_PURGE_CLOSED = "DELETE FROM orders WHERE status IN ('FILLED', 'TRIGGERED')"
+
+# Whole schema as scripts. Indexes are separate: they must be created after the migrations in _init_db
+_SCHEMA = f"""
+BEGIN;
+{_SQL_CREATE_WALLET};
+{_SQL_CREATE_POSITIONS};
+CREATE TABLE IF NOT EXISTS orders
+    (id INTEGER PRIMARY KEY, ticker TEXT, type TEXT, target_price REAL, amount REAL, status TEXT);
+-- Same shape, but `id` is not a key: order ids get reused once the orders table empties out
+CREATE TABLE IF NOT EXISTS closed_orders
+    (id INTEGER, ticker TEXT, type TEXT, target_price REAL, amount REAL, status TEXT);
+COMMIT;
+"""
+_INDEXES = """
+BEGIN;
+-- Partial indexes: only OPEN orders / held positions get indexed, so they stay tiny
+-- while FILLED / TRIGGERED rows pile up
+CREATE INDEX IF NOT EXISTS idx_orders_ticker_status ON orders(ticker, status) WHERE status='OPEN';
+CREATE INDEX IF NOT EXISTS idx_positions_amount ON positions(ticker) WHERE amount > 0;
+-- Largest positions first straight off the index, no sort
+CREATE INDEX IF NOT EXISTS idx_positions_exposure ON positions(exposure DESC) WHERE amount > 0;
+COMMIT;
+"""
+
+# In-memory mode copies the portfolio to disk this often (seconds)
+SNAPSHOT_INTERVAL = 30
 
 class PaperTrader:
-    def __init__(self, db_name="paper_portfolio.db", initial_cash=10000.0):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+    def __init__(self, db_name="paper_portfolio.db", initial_cash=10000.0, in_memory=False, journal_mode="WAL"):
+        """
+        in_memory=True runs the whole portfolio in RAM and snapshots it to `db_name` every
+        SNAPSHOT_INTERVAL seconds - it's paper money, so losing the last few trades on a crash is fine.
+        journal_mode is for the on-disk DB (e.g. "MEMORY" skips the disk journal, at the cost of crash safety).
+        """
+        self.db_name = db_name
+        self.in_memory = in_memory
+        self.journal_mode = journal_mode
+        self._snapshot_timer = None
+        self._closed = False
+        # Held by every batch() and by snapshot(), so a snapshot never sees a half-applied batch.
+        # Re-entrant because batches nest.
+        self._lock = threading.RLock()
+
+        if in_memory:
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False, cached_statements=256, isolation_level=None)
+            # Pick up where the last snapshot left off
+            if os.path.exists(db_name):
+                disk = sqlite3.connect(db_name)
+                disk.backup(self.conn)
+                disk.close()
+        else:
+            self.conn = sqlite3.connect(db_name, check_same_thread=False, cached_statements=256, isolation_level=None)
+        # isolation_level=None = autocommit: a lone write commits by itself, and batch()
+        # is the only place a multi-statement transaction gets opened
+
+        # C-backed rows: still unpack / index like tuples, but also allow row["ticker"]
+        self.conn.row_factory = sqlite3.Row
+        self._batch_depth = 0
+        # Read-through caches for the read-heavy paths (/portfolio, strategy sizing); writers reset them
+        self._balance_cache = None
+        self._holdings_cache = None
         self._init_db(initial_cash)
+        # Tickers with at least one OPEN order: lets the price-check hot path skip SQLite entirely
+        self._open_order_tickers = {row[0] for row in self.conn.execute(_SQL_OPEN_ORDER_TICKERS)}
+
+        if in_memory:
+            self._schedule_snapshot()
+
+    def _schedule_snapshot(self):
+        self._snapshot_timer = threading.Timer(SNAPSHOT_INTERVAL, self._snapshot_loop)
+        self._snapshot_timer.daemon = True
+        self._snapshot_timer.start()
+
+    def _snapshot_loop(self):
+        # A tick already running when close() cancelled the timer must not reschedule itself
+        if self._closed:
+            return
+        self.snapshot()
+        if not self._closed:
+            self._schedule_snapshot()
+
+    def snapshot(self):
+        """Copies the in-memory portfolio to `db_name` (waits for any running batch to finish first)"""
+        with self._lock:
+            if not self.in_memory or self._closed:
+                return
+            try:
+                disk = sqlite3.connect(self.db_name)
+                self.conn.backup(disk)
+                disk.close()
+            except sqlite3.Error as e:
+                print(f"⚠️ Portfolio Snapshot Failed: {e}")
+
+    def close(self):
+        """Stops the snapshot timer, saves a final snapshot and closes the DB (call on shutdown)"""
+        if self._snapshot_timer:
+            self._snapshot_timer.cancel()
+        with self._lock:
+            self.snapshot()
+            self._closed = True
+            self.conn.close()
+
+    @contextmanager
+    def batch(self):
+        """Groups several writes into ONE transaction + commit. Nestable; rolls back on error."""
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so the batch can't fail halfway on a busy DB
+            if not self._batch_depth and not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self._batch_depth == 1 and self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                    self._invalidate()
+                raise
+            else:
+                if self._batch_depth == 1 and self.conn.in_transaction:
+                    self.conn.execute("COMMIT")
+            finally:
+                self._batch_depth -= 1
+
+    def _invalidate(self):
+        """Drops the cached balance / holdings (call after any wallet or position write)"""
+        self._balance_cache = None
+        self._holdings_cache = None
 
     def _init_db(self, initial_cash):
-        # Create Tables
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS wallet (balance REAL)''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS positions (ticker TEXT PRIMARY KEY, amount REAL, avg_cost REAL)''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS orders 
-                            (id INTEGER PRIMARY KEY, ticker TEXT, type TEXT, target_price REAL, amount REAL, status TEXT)''')
-        self.conn.commit()
+        # Connection tuning (once per connection, before any DDL):
+        # WAL (the default) appends to a log instead of rewriting a rollback journal, so each small commit costs far fewer fsyncs
+        self.conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")   # safe with WAL, only fsyncs at checkpoints
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA mmap_size=268435456")  # 256MB
+        self.conn.execute("PRAGMA cache_size=-20000")    # ~20MB page cache
+        self.conn.execute("PRAGMA busy_timeout=5000")    # wait up to 5s for a lock instead of failing
+
+        # Create Tables (one script = one compile, one transaction)
+        self.conn.executescript(_SCHEMA)
+
+        # Older DBs have a key-less `wallet (balance REAL)` table: rebuild it as the id=1 singleton
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(wallet)")]
+        if 'id' not in columns:
+            with self.batch():
+                row = self.conn.execute("SELECT balance FROM wallet LIMIT 1").fetchone()
+                self.conn.execute("DROP TABLE wallet")
+                self.conn.execute(_SQL_CREATE_WALLET)
+                if row:
+                    self.conn.execute(_SQL_SEED_WALLET, (row[0],))
+            print("🔧 Migrated wallet table to a single-row layout")
+
+        # Older DBs have positions without `exposure` (ALTER TABLE can't add a STORED column): copy into a new table
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_xinfo(positions)")]
+        if 'exposure' not in columns:
+            with self.batch():
+                self.conn.execute("ALTER TABLE positions RENAME TO positions_old")
+                self.conn.execute(_SQL_CREATE_POSITIONS)
+                self.conn.execute("INSERT INTO positions (ticker, amount, avg_cost) SELECT ticker, amount, avg_cost FROM positions_old")
+                self.conn.execute("DROP TABLE positions_old")
+            print("🔧 Migrated positions table to add the exposure column")
+
+        # Indexes last, so the migrated tables get them too
+        self.conn.executescript(_INDEXES)
 
         # Set initial cash if empty
-        self.cursor.execute("SELECT count(*) FROM wallet")
-        if self.cursor.fetchone()[0] == 0:
-            self.cursor.execute("INSERT INTO wallet VALUES (?)", (initial_cash,))
-            self.conn.commit()
+        self.conn.execute(_SQL_SEED_WALLET, (initial_cash,))
 
     def get_balance(self):
-        self.cursor.execute("SELECT balance FROM wallet")
-        return self.cursor.fetchone()[0]
+        if self._balance_cache is None:
+            self._balance_cache = self.conn.execute(_SQL_GET_BALANCE).fetchone()[0]
+        return self._balance_cache
 
     def get_holdings(self):
         """Returns list of (ticker, amount, avg_cost)"""
-        self.cursor.execute("SELECT ticker, amount, avg_cost FROM positions WHERE amount > 0")
-        return self.cursor.fetchall()
+        if self._holdings_cache is None:
+            self._holdings_cache = self.conn.execute(_SQL_GET_HOLDINGS).fetchall()
+        return self._holdings_cache
 
     def get_position_exposure(self, ticker):
         """Returns dollar value of a specific position"""
-        self.cursor.execute("SELECT amount, avg_cost FROM positions WHERE ticker=?", (ticker,))
-        row = self.cursor.fetchone()
-        if row:
-            return row[0] * row[1]
-        return 0.0
+        row = self.conn.execute(_SQL_GET_EXPOSURE, (ticker,)).fetchone()
+        return row[0] if row else 0.0
+
+    def get_all_exposures(self):
+        """Returns {ticker: dollar value} for every held position, in one query"""
+        return dict(self.conn.execute(_SQL_GET_ALL_EXPOSURES).fetchall())
 
     def get_open_orders(self):
-        self.cursor.execute("SELECT ticker, type, target_price, amount FROM orders WHERE status='OPEN'")
-        return self.cursor.fetchall()
+        return self.conn.execute(_SQL_GET_OPEN_ORDERS).fetchall()
 
     def execute_trade(self, ticker, action, price, amount_usd):
-        balance = self.get_balance()
-        
         if action == "BUY":
-            if balance < amount_usd: return "❌ Insufficient Funds"
-            
-            quantity = amount_usd / price
-            new_balance = balance - amount_usd
-            
-            # Update Wallet
-            self.cursor.execute("UPDATE wallet SET balance = ?", (new_balance,))
-            
-            # Update Position
-            self.cursor.execute("SELECT amount, avg_cost FROM positions WHERE ticker=?", (ticker,))
-            row = self.cursor.fetchone()
-            if row:
-                current_qty, current_avg = row
-                total_cost = (current_qty * current_avg) + amount_usd
-                total_qty = current_qty + quantity
-                new_avg = total_cost / total_qty
-                self.cursor.execute("UPDATE positions SET amount=?, avg_cost=? WHERE ticker=?", (total_qty, new_avg, ticker))
-            else:
-                self.cursor.execute("INSERT INTO positions VALUES (?, ?, ?)", (ticker, quantity, price))
-            
-            self.conn.commit()
+            # Wallet debit + position in one transaction (one fsync per trade)
+            with self.batch():
+                debit = self.conn.execute(_SQL_DEBIT, (amount_usd, amount_usd))
+                if debit.rowcount == 0: return "❌ Insufficient Funds"
+                
+                quantity = amount_usd / price
+                self.conn.execute(_SQL_UPSERT_POSITION, (ticker, quantity, price))
+                self._invalidate()
             return f"✅ **BOUGHT** {quantity:.4f} {ticker} @ ${price:.2f}"
 
         return "❌ Unknown Action"
 
     def log_pending_order(self, ticker, order_type, price, amount_usd):
         qty = amount_usd / price if price > 0 else 0
-        self.cursor.execute("INSERT INTO orders (ticker, type, target_price, amount, status) VALUES (?, ?, ?, ?, 'OPEN')", 
-                           (ticker, order_type, price, qty))
-        self.conn.commit()
+        self.conn.execute(_SQL_INSERT_ORDER, (ticker, order_type, price, qty))
+        self._open_order_tickers.add(ticker)
         return f"⏳ **QUEUED:** {order_type} @ ${price:.2f}"
 
     def check_pending_orders(self, ticker, current_price):
-        """Checks if any Limit/Stop orders should trigger"""
+        """Checks if any Limit/Stop orders should trigger. Returns the fill / trigger messages."""
+        # Common case: nothing queued for this ticker, no query
+        if ticker not in self._open_order_tickers:
+            return []
+
+        # Only the triggered rows come back, untriggered orders never leave SQLite
+        matched = self.conn.execute(_SQL_MATCH_TICKER_ORDERS, (ticker, current_price)).fetchall()
+        if not matched:
+            return []
+        logs = self._fill_orders(matched)
+
+        # Every open order for this ticker just closed
+        if self.conn.execute(_SQL_HAS_OPEN_ORDERS, (ticker,)).fetchone() is None:
+            self._open_order_tickers.discard(ticker)
+        return logs
+
+    def check_all_pending(self, prices):
+        """
+        Same as check_pending_orders, but for a whole tick at once: {ticker: price}.
+        The prices are joined against orders in ONE query instead of one query per ticker.
+        """
+        watched = [(ticker, price) for ticker, price in prices.items() if ticker in self._open_order_tickers]
+        if not watched:
+            return []
+
+        values = ", ".join(["(?, ?)"] * len(watched))
+        params = [x for pair in watched for x in pair]
+        matched = self.conn.execute(_SQL_MATCH_PENDING.format(values=values), params).fetchall()
+        logs = self._fill_orders(matched)
+
+        if matched:
+            self._open_order_tickers = {row[0] for row in self.conn.execute(_SQL_OPEN_ORDER_TICKERS)}
+        return logs
+
+    def _fill_orders(self, matched):
+        """Fills / triggers already-matched (id, ticker, type, target_price, amount) rows. Returns the messages."""
         logs = []
-        self.cursor.execute("SELECT id, type, target_price, amount FROM orders WHERE ticker=? AND status='OPEN'", (ticker,))
-        orders = self.cursor.fetchall()
+        if not matched:
+            return logs
+
+        filled_ids = []
+        triggered_ids = []
         
-        for order_id, order_type, target, qty in orders:
-            # Limit Buy: Trigger if price drops BELOW target
-            if order_type == "LIMIT_BUY" and current_price <= target:
-                cost = qty * target
-                self.execute_trade(ticker, "BUY", target, cost)
-                self.cursor.execute("UPDATE orders SET status='FILLED' WHERE id=?", (order_id,))
-                logs.append(f"🔔 **LIMIT FILLED:** {ticker} @ ${target:.2f}")
-
-            # Stop Loss: Trigger if price drops BELOW target
-            elif order_type == "STOP_LOSS" and current_price <= target:
-                # Sell Logic (Simplified: Close entire position)
-                # For this version, we just notify you, as selling logic requires more complex tracking
-                self.cursor.execute("UPDATE orders SET status='TRIGGERED' WHERE id=?", (order_id,))
-                logs.append(f"🛑 **STOP LOSS HIT:** {ticker} @ ${target:.2f} - CHECK APP!")
+        # All fills in ONE transaction: N triggered orders = 1 commit
+        with self.batch():
+            for order_id, ticker, order_type, target, qty in matched:
+                if order_type == "LIMIT_BUY":
+                    cost = qty * target
+                    self.execute_trade(ticker, "BUY", target, cost)
+                    filled_ids.append((order_id,))
+                    logs.append(f"🔔 **LIMIT FILLED:** {ticker} @ ${target:.2f}")
+
+                elif order_type == "STOP_LOSS":
+                    # Sell Logic (Simplified: Close entire position)
+                    # For this version, we just notify you, as selling logic requires more complex tracking
+                    triggered_ids.append((order_id,))
+                    logs.append(f"🛑 **STOP LOSS HIT:** {ticker} @ ${target:.2f} - CHECK APP!")
+
+            # Status updates go out as two batched statements instead of one per order
+            if filled_ids:
+                self.conn.executemany(_SQL_FILL_ORDER, filled_ids)
+            if triggered_ids:
+                self.conn.executemany(_SQL_TRIGGER_ORDER, triggered_ids)
+            self.conn.execute(_SQL_ARCHIVE_ORDERS)
+            self.conn.execute(_SQL_PURGE_CLOSED)
+        return logs
 
     def reset_portfolio(self, initial_cash=10000.0):
         """Wipes all data and resets wallet to initial cash."""
-        self.cursor.execute("DELETE FROM positions")
-        self.cursor.execute("DELETE FROM orders")
-        self.cursor.execute("DELETE FROM wallet")
-        self.cursor.execute("INSERT INTO wallet VALUES (?)", (initial_cash,))
-        self.conn.commit()
+        with self.batch():
+            self.conn.execute("DELETE FROM positions")
+            self.conn.execute("DELETE FROM orders")
+            self.conn.execute("DELETE FROM closed_orders")
+            self.conn.execute(_SQL_RESET_WALLET, (initial_cash,))
+            self._invalidate()
+        self._open_order_tickers.clear()
         return f"✅ **RESET COMPLETE**\nAccount reset to ${initial_cash:,.2f}"
 
     def clear_positions(self):
         """Removes all positions and orders (used after selling all)."""
-        self.cursor.execute("DELETE FROM positions")
-        self.cursor.execute("DELETE FROM orders")
-        self.conn.commit()
+        with self.batch():
+            self.conn.execute("DELETE FROM positions")
+            self.conn.execute("DELETE FROM orders")
+            self.conn.execute("DELETE FROM closed_orders")
+            self._invalidate()
+        self._open_order_tickers.clear()
     
     def deposit_cash(self, amount):
         """Adds cash to wallet (used from sell_all)."""
-        current = self.get_balance()
-        new_bal = current + amount
-        self.cursor.execute("UPDATE wallet SET balance = ?", (new_bal,))         
-        self.conn.commit()
-        return logs
\ No newline at end of file
+        self.conn.execute(_SQL_DEPOSIT, (amount,))
+        self._invalidate()